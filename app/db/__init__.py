@@ -1,26 +1,71 @@
+from functools import partial, wraps
+from inspect import signature
+from operator import attrgetter
 from typing import Any, Self, List
-from typing import Tuple, Optional, Generator
+from typing import Tuple, Optional, Generator, Union
 
-from sqlalchemy import create_engine, QueuePool
-from sqlalchemy import inspect
+from sqlalchemy import create_engine, QueuePool, event
+from sqlalchemy import select, insert, update, delete, ScalarResult
 from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm.attributes import instance_state
 from sqlalchemy.orm import sessionmaker, Session, scoped_session, as_declarative
 
 from app.core.config import settings
 
-# 数据库引擎
+# 数据库引擎，每次检出独立连接，SQLite本地文件无需连接探活
 Engine = create_engine(f"sqlite:///{settings.CONFIG_PATH}/user.db",
-                       pool_pre_ping=True,
+                       pool_pre_ping=False,
                        echo=False,
                        poolclass=QueuePool,
                        pool_size=1024,
-                       pool_recycle=3600,
-                       pool_timeout=180,
-                       max_overflow=10,
-                       connect_args={"timeout": 60})
+                       connect_args={"timeout": 60, "check_same_thread": False})
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    新建连接时设置SQLite参数：WAL日志模式，读写互不阻塞并减少fsync次数
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
 # 会话工厂
 SessionFactory = sessionmaker(bind=Engine)
 
+
+@event.listens_for(SessionFactory, "after_flush")
+def mark_session_flushed(session: Session, flush_context):
+    """
+    标记会话已有写入，用于判断是否需要提交事务
+    """
+    session.info["_changed"] = True
+
+
+@event.listens_for(SessionFactory, "do_orm_execute")
+def mark_session_executed(orm_execute_state):
+    """
+    执行非查询语句时标记会话已有写入，text()等无法识别类型的语句同样标记，宁可多提交也不丢失写入
+    """
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["_changed"] = True
+
+
+@event.listens_for(SessionFactory, "after_transaction_end")
+def reset_session_changed(session: Session, transaction):
+    """
+    事务结束后清除写入标记
+    """
+    if transaction.parent is None:
+        session.info.pop("_changed", None)
+
+
 # 多线程全局使用的数据库会话
 ScopedSession = scoped_session(SessionFactory)
 
@@ -30,69 +75,88 @@ def get_db() -> Generator:
     获取数据库会话，用于WEB请求
     :return: Session
     """
-    db = None
-    try:
-        db = SessionFactory()
+    with SessionFactory() as db:
         yield db
-    finally:
-        if db:
-            db.close()
 
 
-def get_args_db(args: tuple, kwargs: dict) -> Optional[Session]:
+def get_db_index(func) -> Optional[int]:
+    """
+    获取函数中db参数在位置参数中的序号，装饰时计算一次，不存在db参数时返回None
     """
-    从参数中获取数据库Session对象
+    params = list(signature(func).parameters)
+    if 'db' in params:
+        return params.index('db')
+    return None
+
+
+def get_args_db(args: tuple, kwargs: dict, index: Optional[int] = None) -> Optional[Session]:
     """
-    db = None
-    if args:
-        for arg in args:
-            if isinstance(arg, Session):
-                db = arg
-                break
-    if kwargs:
-        for key, value in kwargs.items():
+    从参数中获取数据库Session对象，index为db参数在位置参数中的序号，为None时在全部参数中查找
+    """
+    if index is None:
+        for value in (*args, *kwargs.values()):
             if isinstance(value, Session):
-                db = value
-                break
-    return db
+                return value
+        return None
+    if 'db' in kwargs:
+        db = kwargs['db']
+    elif len(args) > index:
+        db = args[index]
+    else:
+        return None
+    # db位置上可能不是会话，如直接调用接口函数时的Depends默认值
+    return db if isinstance(db, Session) else None
 
 
-def update_args_db(args: tuple, kwargs: dict, db: Session) -> Tuple[tuple, dict]:
+def update_args_db(args: tuple, kwargs: dict, db: Session,
+                   index: Optional[int] = None) -> Tuple[Union[tuple, list], dict]:
     """
-    更新参数中的数据库Session对象，关键字传参时更新db的值，否则更新第1或第2个参数
+    更新参数中的数据库Session对象，位置传参时更新第index个参数，否则更新db关键字参数
+    index为None时按原规则更新第1或第2个参数
     """
-    if kwargs and 'db' in kwargs:
-        kwargs['db'] = db
-    elif args:
-        if args[0] is None:
-            args = (db, *args[1:])
+    if index is None:
+        if 'db' in kwargs:
+            kwargs['db'] = db
+        elif args:
+            index = 0 if args[0] is None else 1
         else:
-            args = (args[0], db, *args[2:])
+            return args, kwargs
+    if len(args) > index:
+        args = list(args)
+        args[index] = db
+    else:
+        kwargs['db'] = db
     return args, kwargs
 
 
 def db_update(func):
     """
-    数据库更新类操作装饰器，第一个参数必须是数据库会话或存在db参数
+    数据库更新类操作装饰器，通过db参数传入数据库会话，未传入时自动创建
+    函数没有db参数时，在全部参数中查找数据库会话
     """
+    index = get_db_index(func)
+    _get_args_db = partial(get_args_db, index=index)
+    _update_args_db = partial(update_args_db, index=index)
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         # 是否关闭数据库会话
         _close_db = False
         # 从参数中获取数据库会话
-        db = get_args_db(args, kwargs)
+        db = _get_args_db(args, kwargs)
         if not db:
-            # 如果没有获取到数据库会话，创建一个
-            db = ScopedSession()
+            # 如果没有获取到数据库会话，创建一个独立会话，用完即关闭，避免线程复用时会话状态累积
+            db = SessionFactory()
             # 标记需要关闭数据库会话
             _close_db = True
             # 更新参数中的数据库会话
-            args, kwargs = update_args_db(args, kwargs, db)
+            args, kwargs = _update_args_db(args, kwargs, db)
         try:
             # 执行函数
             result = func(*args, **kwargs)
-            # 提交事务
-            db.commit()
+            # 存在变更时才提交事务，无变更的操作不产生多余的提交
+            if db.new or db.dirty or db.deleted or db.info.get("_changed"):
+                db.commit()
         except Exception as err:
             # 回滚事务
             db.rollback()
@@ -108,22 +172,27 @@ def db_update(func):
 
 def db_query(func):
     """
-    数据库查询操作装饰器，第一个参数必须是数据库会话或存在db参数
+    数据库查询操作装饰器，通过db参数传入数据库会话，未传入时自动创建
+    函数没有db参数时，在全部参数中查找数据库会话
     注意：db.query列表数据时，需要转换为list返回
     """
+    index = get_db_index(func)
+    _get_args_db = partial(get_args_db, index=index)
+    _update_args_db = partial(update_args_db, index=index)
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         # 是否关闭数据库会话
         _close_db = False
         # 从参数中获取数据库会话
-        db = get_args_db(args, kwargs)
+        db = _get_args_db(args, kwargs)
         if not db:
-            # 如果没有获取到数据库会话，创建一个
-            db = ScopedSession()
+            # 如果没有获取到数据库会话，创建一个独立会话，用完即关闭，避免线程复用时会话状态累积
+            db = SessionFactory()
             # 标记需要关闭数据库会话
             _close_db = True
             # 更新参数中的数据库会话
-            args, kwargs = update_args_db(args, kwargs, db)
+            args, kwargs = _update_args_db(args, kwargs, db)
         try:
             # 执行函数
             result = func(*args, **kwargs)
@@ -147,6 +216,19 @@ class Base:
     def create(self, db: Session):
         db.add(self)
 
+    @classmethod
+    @db_update
+    def create_many(cls, db: Session, instances: List[Self]):
+        """
+        批量新增记录，全部数据一次提交
+        注意：不触发ORM事件、不回填主键，适用于导入等批量写入场景
+        """
+        if not instances:
+            return
+        columns = cls.__table__.columns
+        db.execute(insert(cls), [{k: v for k, v in instance_state(instance).dict.items() if k in columns}
+                                 for instance in instances])
+
     @classmethod
     @db_query
     def get(cls, db: Session, rid: int) -> Self:
@@ -157,27 +239,55 @@ class Base:
         payload = {k: v for k, v in payload.items() if v is not None}
         for key, value in payload.items():
             setattr(self, key, value)
-        if inspect(self).detached:
-            db.add(self)
+        state = instance_state(self)
+        if state.detached:
+            # 游离对象直接执行UPDATE语句，不再挂回会话走属性变更追踪，赋值仅用于更新调用方持有的对象
+            values = {k: v for k, v in payload.items() if k in self.__table__.columns}
+            if values:
+                db.execute(update(self.__class__).where(self.__class__.id == state.identity[0]).values(values))
 
     @classmethod
     @db_update
     def delete(cls, db: Session, rid):
-        db.query(cls).filter(cls.id == rid).delete()
+        db.execute(delete(cls).where(cls.id == rid).execution_options(synchronize_session=False))
 
     @classmethod
     @db_update
     def truncate(cls, db: Session):
-        db.query(cls).delete()
+        db.execute(delete(cls).execution_options(synchronize_session=False))
 
     @classmethod
     @db_query
     def list(cls, db: Session) -> List[Self]:
-        result = db.query(cls).all()
-        return list(result)
+        return db.scalars(select(cls)).all()
+
+    @classmethod
+    def iter_all(cls, db: Session, chunk: int = 1000) -> ScalarResult:
+        """
+        分批流式读取全部记录，需由调用方传入db并在迭代完成前保持会话打开
+        :param chunk: 每批加载的行数
+        """
+        if not db:
+            raise ValueError("流式读取必须传入数据库会话")
+        return db.execute(select(cls).execution_options(yield_per=chunk)).scalars()
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name, None) for c in self.__table__.columns}
+        try:
+            values = self._column_getter(self)
+        except AttributeError:
+            # 存在取不到值的字段时逐个取值，取不到的字段为None
+            return {name: getattr(self, name, None) for name in self._column_names}
+        return dict(zip(self._column_names, values))
+
+    @classmethod
+    def __declare_last__(cls):
+        """
+        映射配置完成后缓存字段名及取值函数，避免to_dict每次遍历表字段
+        """
+        cls._column_names = tuple(c.name for c in cls.__table__.columns)
+        getter = attrgetter(*cls._column_names)
+        # 只有一个字段时attrgetter返回单个值而非元组
+        cls._column_getter = getter if len(cls._column_names) > 1 else staticmethod(lambda obj: (getter(obj),))
 
     @declared_attr
     def __tablename__(self) -> str:
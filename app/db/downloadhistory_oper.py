@@ -33,9 +33,7 @@ class DownloadHistoryOper(DbOper):
         """
         新增下载历史文件
         """
-        for file_item in file_items:
-            downloadfile = DownloadFiles(**file_item)
-            downloadfile.create(self._db)
+        DownloadFiles.create_many(self._db, [DownloadFiles(**file_item) for file_item in file_items])
 
     def truncate_files(self):
         """
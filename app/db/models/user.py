@@ -1,13 +1,44 @@
+import hashlib
+import secrets
+import threading
 from typing import Tuple, Optional
 
+from cachetools import TTLCache
 from sqlalchemy import Boolean, Column, Integer, String, Sequence
-from sqlalchemy.orm import Session
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 from app.core.security import verify_password
 from app.db import db_query, db_update, Base
 from app.schemas import User
 from app.utils.otp import OtpUtils
 
+# 用户信息缓存，按用户名缓存表字段，用户数据变更时清空
+_user_cache = TTLCache(maxsize=1024, ttl=60)
+_user_cache_lock = threading.Lock()
+# 用户信息缓存版本，清空缓存时递增，查询期间版本变化则不回填缓存
+_user_cache_generation = 0
+# 密码校验通过的结果缓存，键为密码与密码哈希的带密钥摘要，校验失败不缓存
+_password_cache = TTLCache(maxsize=1024, ttl=30)
+_password_cache_lock = threading.Lock()
+_password_cache_secret = secrets.token_bytes(32)
+
+
+def _verify_password(password: str, hashed_password: str) -> bool:
+    """
+    校验密码，短时间内重复校验通过时直接返回，避免重复计算bcrypt
+    """
+    key = hashlib.blake2b(password.encode() + b"\0" + hashed_password.encode(),
+                          key=_password_cache_secret, digest_size=16).hexdigest()
+    with _password_cache_lock:
+        if key in _password_cache:
+            return True
+    if not verify_password(password, hashed_password):
+        return False
+    with _password_cache_lock:
+        _password_cache[key] = True
+    return True
+
 
 class User(Base):
     """
@@ -35,10 +66,10 @@ class User(Base):
     @staticmethod
     @db_query
     def authenticate(db: Session, name: str, password: str, otp_password: str) -> Tuple[bool, Optional[User]]:
-        user = db.query(User).filter(User.name == name).first()
+        user = User.get_by_name(db, name)
         if not user:
             return False, None
-        if not verify_password(password, str(user.hashed_password)):
+        if not _verify_password(password, str(user.hashed_password)):
             return False, user
         if user.is_otp:
             if not otp_password or not OtpUtils.check(user.otp_secret, otp_password):
@@ -48,7 +79,44 @@ class User(Base):
     @staticmethod
     @db_query
     def get_by_name(db: Session, name: str):
-        return db.query(User).filter(User.name == name).first()
+        """
+        按用户名查询用户，优先从缓存读取，返回与会话无关的游离对象
+        """
+        with _user_cache_lock:
+            data = _user_cache.get(name)
+            generation = _user_cache_generation
+        if data is None:
+            # lambda_stmt 缓存编译后的SQL，name作为绑定参数，登录等高频查询无需重复编译
+            user = db.execute(lambda_stmt(lambda: select(User).where(User.name == name).limit(1))).scalar()
+            if not user:
+                return None
+            data = user.to_dict()
+            with _user_cache_lock:
+                # 查询期间缓存被清空时，查到的可能是旧数据，不回填
+                if generation == _user_cache_generation:
+                    _user_cache[name] = data
+        user = User(**data)
+        make_transient_to_detached(user)
+        return user
+
+    def update(self, db: Session, payload: dict):
+        super().update(db, payload)
+        self.clear_cache()
+
+    @classmethod
+    def delete(cls, db: Session, rid):
+        super().delete(db, rid)
+        cls.clear_cache()
+
+    @staticmethod
+    def clear_cache():
+        """
+        清空用户信息缓存
+        """
+        global _user_cache_generation
+        with _user_cache_lock:
+            _user_cache_generation += 1
+            _user_cache.clear()
 
     @db_update
     def delete_by_name(self, db: Session, name: str):
@@ -1,5 +1,6 @@
 import unittest
 
+from tests.test_db import DbCommitTest, UserCacheTest
 from tests.test_metainfo import MetaInfoTest
 
 if __name__ == '__main__':
@@ -8,6 +9,23 @@ if __name__ == '__main__':
     # 测试名称识别
     suite.addTest(MetaInfoTest('test_metainfo'))
 
+    # 测试数据库提交
+    suite.addTest(DbCommitTest('test_core_delete'))
+    suite.addTest(DbCommitTest('test_query_update'))
+    suite.addTest(DbCommitTest('test_noop_delete_by_name'))
+    suite.addTest(DbCommitTest('test_create_many'))
+    suite.addTest(DbCommitTest('test_flag_reset_after_commit'))
+    suite.addTest(DbCommitTest('test_text_write'))
+    suite.addTest(DbCommitTest('test_select_not_marked'))
+    suite.addTest(DbCommitTest('test_non_session_db_arg'))
+
+    # 测试用户缓存
+    suite.addTest(UserCacheTest('test_update_invalidation'))
+    suite.addTest(UserCacheTest('test_delete_invalidation'))
+    suite.addTest(UserCacheTest('test_disabled_user_login'))
+    suite.addTest(UserCacheTest('test_password_reset_login'))
+    suite.addTest(UserCacheTest('test_clear_during_read'))
+
     # 运行测试
     runner = unittest.TextTestRunner()
     runner.run(suite)
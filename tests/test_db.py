@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from fastapi import Depends
+from sqlalchemy import create_engine, event, text
+
+from app.core.security import get_password_hash
+from app.db import Base, Engine, SessionFactory, get_db, db_update
+from app.db.models import user as user_model
+from app.db.models.downloadhistory import DownloadFiles
+from app.db.models.systemconfig import SystemConfig
+from app.db.models.user import User
+
+
+class DbTestCase(TestCase):
+    """
+    使用临时数据库的测试基类
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls._tempdir = tempfile.TemporaryDirectory()
+        cls._engine = create_engine(f"sqlite:///{Path(cls._tempdir.name) / 'user.db'}")
+        Base.metadata.create_all(bind=cls._engine)
+        SessionFactory.configure(bind=cls._engine)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        SessionFactory.configure(bind=Engine)
+        cls._engine.dispose()
+        cls._tempdir.cleanup()
+
+
+class DbCommitTest(DbTestCase):
+    def setUp(self) -> None:
+        self.commits = 0
+        event.listen(SessionFactory, "after_commit", self._on_commit)
+
+    def tearDown(self) -> None:
+        event.remove(SessionFactory, "after_commit", self._on_commit)
+
+    def _on_commit(self, session):
+        self.commits += 1
+
+    def test_core_delete(self):
+        conf = SystemConfig(key="core_delete", value="1")
+        conf.create(None)
+        self.commits = 0
+        with SessionFactory() as db:
+            rid = SystemConfig.get_by_key(db, "core_delete").id
+            SystemConfig.delete(db, rid)
+            self.assertFalse(db.info.get("_changed"))
+        self.assertEqual(self.commits, 1)
+        self.assertIsNone(SystemConfig.get_by_key(None, "core_delete"))
+
+    def test_query_update(self):
+        DownloadFiles(fullpath="/query/update", state=1).create(None)
+        self.commits = 0
+        DownloadFiles.delete_by_fullpath(None, "/query/update")
+        self.assertEqual(self.commits, 1)
+        with SessionFactory() as db:
+            row = db.query(DownloadFiles).filter(DownloadFiles.fullpath == "/query/update").first()
+            self.assertEqual(row.state, 0)
+
+    def test_noop_delete_by_name(self):
+        User.delete_by_name(User(), None, "no_such_user")
+        self.assertEqual(self.commits, 0)
+
+    def test_create_many(self):
+        DownloadFiles.create_many(None, [DownloadFiles(download_hash="create_many", filepath=f"{i}")
+                                         for i in range(3)])
+        self.assertEqual(self.commits, 1)
+        rows = DownloadFiles.get_by_hash(None, "create_many")
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row.state for row in rows}, {1})
+
+    def test_flag_reset_after_commit(self):
+        with SessionFactory() as db:
+            db.add(SystemConfig(key="flag_reset", value="1"))
+            db.flush()
+            self.assertTrue(db.info.get("_changed"))
+            db.commit()
+            self.assertFalse(db.info.get("_changed"))
+
+    def test_text_write(self):
+        @db_update
+        def set_value(db, key: str, value: str):
+            db.execute(text("UPDATE systemconfig SET value = :value WHERE key = :key"),
+                       {"key": key, "value": value})
+
+        SystemConfig(key="text_write", value="1").create(None)
+        self.commits = 0
+        set_value(None, "text_write", "raw")
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(SystemConfig.get_by_key(None, "text_write").value, "raw")
+
+    def test_select_not_marked(self):
+        with SessionFactory() as db:
+            SystemConfig.list(db)
+            User.get_by_name(db, "no_such_user")
+            self.assertFalse(db.info.get("_changed"))
+
+    def test_non_session_db_arg(self):
+        placeholder = Depends(get_db)
+        self.assertIsInstance(SystemConfig.list(placeholder), list)
+        self.assertIsNone(SystemConfig.get_by_key(db=placeholder, key="no_such_key"))
+
+
+class UserCacheTest(DbTestCase):
+    def setUp(self) -> None:
+        User.clear_cache()
+        User(name="cache_user", hashed_password=get_password_hash("old_pass1")).create(None)
+
+    def tearDown(self) -> None:
+        User.delete_by_name(User(), None, "cache_user")
+
+    def test_update_invalidation(self):
+        self.assertIsNone(User.get_by_name(None, "cache_user").email)
+        User.get_by_name(None, "cache_user").update(None, {"email": "new@mail"})
+        self.assertEqual(User.get_by_name(None, "cache_user").email, "new@mail")
+
+    def test_delete_invalidation(self):
+        self.assertIsNotNone(User.get_by_name(None, "cache_user"))
+        User.delete_by_name(User(), None, "cache_user")
+        self.assertIsNone(User.get_by_name(None, "cache_user"))
+
+    def test_disabled_user_login(self):
+        success, user = User.authenticate(None, "cache_user", "old_pass1", None)
+        self.assertTrue(success)
+        self.assertTrue(user.is_active)
+        user.update(None, {"is_active": False})
+        success, user = User.authenticate(None, "cache_user", "old_pass1", None)
+        self.assertTrue(success)
+        self.assertFalse(user.is_active)
+
+    def test_password_reset_login(self):
+        self.assertTrue(User.authenticate(None, "cache_user", "old_pass1", None)[0])
+        User.get_by_name(None, "cache_user").update(None, {"hashed_password": get_password_hash("new_pass1")})
+        self.assertFalse(User.authenticate(None, "cache_user", "old_pass1", None)[0])
+        self.assertTrue(User.authenticate(None, "cache_user", "new_pass1", None)[0])
+
+    def test_clear_during_read(self):
+        def clear_cache(orm_execute_state):
+            User.clear_cache()
+
+        event.listen(SessionFactory, "do_orm_execute", clear_cache)
+        try:
+            self.assertIsNotNone(User.get_by_name(None, "cache_user"))
+        finally:
+            event.remove(SessionFactory, "do_orm_execute", clear_cache)
+        self.assertNotIn("cache_user", user_model._user_cache)
+        User.get_by_name(None, "cache_user")
+        self.assertIn("cache_user", user_model._user_cache)